@@ -18,6 +18,7 @@ Options:
   --proxy PROXY               Specify a bastion host for ProxyCommand
   --region-suffix             Append the region name at the end of the host
   --ssh-key-name SSH_KEY_NAME Override the ssh key to use
+  --state-file STATE_FILE     Keep the inventory in STATE_FILE and only fetch instances that changed since the last run (needs ec2:DescribeInstanceStatus)
   --strict-hostkey-checking   Do not include StrictHostKeyChecking=no in ssh config
   --tags TAGS []              Comma-separated list of tag names to be considered for concatenation [default: Name,]
   --user USER                 Override the ssh username for all hosts
@@ -32,10 +33,13 @@ Examples:
 
 import os
 from docopt import docopt
+import datetime
+import json
 import re
 import sys
 import time
 import boto3
+from botocore.exceptions import ClientError
 import logging
 
 AMI_NAMES_TO_USER = {
@@ -58,6 +62,8 @@ BLACKLISTED_REGIONS = [
 
 ]
 
+STATE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 
 
 def generate_id(instance, tags_filter, add_region_suffix):
@@ -163,17 +169,152 @@ def print_superputty(config_list):
     print('''</ArrayOfSessionData>''')
 
 
+def load_state(state_file, options):
+    """
+    Load the inventory saved by a previous run
+    :param state_file: path of the JSON state file
+    :param options: dict of the arguments that shape host ids, must match the saved ones
+    :return: the state dict, or None if there is no usable state and a full refresh is needed
+    """
+    logging.debug('load_state()')
+    try:
+        with open(state_file) as state_fp:
+            state = json.load(state_fp)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(state, dict):
+        logging.warning("Ignoring state file '{0}', it does not hold an inventory".format(state_file))
+        return None
+
+    if state.get('options') != options:
+        logging.info("Options changed since the last run, doing a full refresh")
+        return None
+
+    if (not isinstance(state.get('ami_usernames'), dict) or not isinstance(state.get('regions'), dict)
+            or not all(valid_region_state(region_state) for region_state in state['regions'].values())):
+        logging.warning("Ignoring state file '{0}', it does not hold an inventory".format(state_file))
+        return None
+
+    return state
+
+
+def valid_region_state(region_state):
+    """
+    Check a region entry of the state file has the shape process_aws saves
+    :param region_state: the region's entry from the state file
+    :return: True if the entry can be used for an incremental refresh
+    """
+    try:
+        datetime.datetime.strptime(region_state['synced'], STATE_TIME_FORMAT)
+        return (isinstance(region_state['ignored'], list)
+                and isinstance(region_state['launch_times'], dict)
+                and all(isinstance(host, list) and len(host) == 6
+                        and all(field is None or isinstance(field, str) for field in host)
+                        for host in region_state['hosts'].values()))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+
+
+def save_state(state_file, options, ami_usernames, regions):
+    """
+    Save the inventory so the next run only has to fetch what changed
+    :param state_file: path of the JSON state file
+    :param options: dict of the arguments that shape host ids
+    :param ami_usernames: dict of ImageId to ssh user
+    :param regions: dict keyed on RegionName, value is a dict of 'synced', 'hosts', 'ignored' and 'launch_times'
+    :return: None
+    """
+    logging.debug('save_state()')
+    tmp_state_file = state_file + '.tmp'
+    try:
+        with open(tmp_state_file, 'w') as state_fp:
+            json.dump({'options': options, 'ami_usernames': ami_usernames, 'regions': regions}, state_fp)
+        os.replace(tmp_state_file, state_file)
+    except (IOError, OSError) as e:
+        logging.warning("Saving state file '{0}' failed: {1}".format(state_file, e))
+
+
+def describe_changed_instances(ec2_service, region_state):
+    """
+    Split the running instances of a region into ones already known and ones to fetch. An instance is fetched when
+    its id is unknown, or when its launch-time falls on a day since the last sync and differs from the saved one,
+    which catches instances that were stopped and started again with a new ip
+    :param ec2_service: boto3 ec2 client for the region
+    :param region_state: the region's entry from the state file
+    :return: a (kept_hosts, kept_ignored, reservations) tuple, kept_hosts being the still running host tuples
+             keyed on InstanceId and kept_ignored the still running ids that were skipped before. None if the last
+             sync is too old to filter on, and a full refresh is needed
+    """
+    logging.debug('describe_changed_instances()')
+    synced = datetime.datetime.strptime(region_state['synced'], STATE_TIME_FORMAT).date()
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    if (today - synced).days >= 200:  # EC2 takes at most 200 values per filter
+        return None
+    launch_days = [(synced + datetime.timedelta(days=i)).strftime('%Y-%m-%d*')
+                   for i in range((today - synced).days + 1)]
+
+    running_ids = set()
+    paginator = ec2_service.get_paginator('describe_instance_status')
+    for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]):
+        for status in page['InstanceStatuses']:
+            running_ids.add(status['InstanceId'])
+
+    launch_times = region_state['launch_times']
+    kept_hosts = dict((k, tuple(v)) for k, v in region_state['hosts'].items() if k in running_ids)
+    kept_ignored = set(region_state['ignored']) & running_ids
+
+    reservations = []
+    described_ids = set()
+    paginator = ec2_service.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['running']},
+                                            {'Name': 'launch-time', 'Values': launch_days}]):
+        for launch_request in page['Reservations']:
+            launch_request['Instances'] = [
+                instance for instance in launch_request['Instances']
+                if launch_times.get(instance['InstanceId']) != str(instance['LaunchTime'])]
+            for instance in launch_request['Instances']:
+                described_ids.add(instance['InstanceId'])
+                kept_hosts.pop(instance['InstanceId'], None)
+                kept_ignored.discard(instance['InstanceId'])
+            if launch_request['Instances']:
+                reservations.append(launch_request)
+
+    # Running ids the launch-time query missed, e.g. instances that were still pending at the last sync.
+    # An instance-id filter, unlike InstanceIds, doesn't raise for ids that vanished since the status call
+    new_ids = sorted(running_ids - set(kept_hosts) - kept_ignored - described_ids)
+    for i in range(0, len(new_ids), 200):
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': new_ids[i:i + 200]}]):
+            reservations += page['Reservations']
+
+    return kept_hosts, sorted(kept_ignored), reservations
+
+
 def process_aws(args_profile, args_tags_filter, args_region_suffix, args_whitelist_regions, args_user,
-                args_default_user, args_private_ip, args_host_prefix, args_host_postfix):
+                args_default_user, args_private_ip, args_host_prefix, args_host_postfix, args_state_file=None):
     """
     :return: a list of (ami_image_id, host_id, instance_id, image_id, key_name, ip_addr) tuples
     """
     logging.debug('process_aws()')
     ret = []
     instances = {}  # dict keyed on InstanceId, value is the instance
+    instance_regions = {}  # dict keyed on InstanceId, value is the RegionName
     counts_total = {}
     counts_incremental = {}
     ami_usernames = AMI_IDS_TO_USER.copy()  # ToDo: Global
+    reused_ids = set()  # ssh config ids carried over from the state file
+    regions_state = {}
+
+    state = None
+    if args_state_file:
+        options = {
+            'profile': args_profile, 'tags': args_tags_filter, 'region_suffix': args_region_suffix,
+            'whitelist_regions': args_whitelist_regions, 'user': args_user, 'default_user': args_default_user,
+            'private': args_private_ip, 'prefix': args_host_prefix, 'postfix': args_host_postfix,
+        }
+        state = load_state(args_state_file, options)
+        if state is not None:
+            ami_usernames.update(state.get('ami_usernames', {}))
 
     if args_profile:
         session = boto3.Session(profile_name=args_profile)
@@ -192,15 +333,45 @@ def process_aws(args_profile, args_tags_filter, args_region_suffix, args_whiteli
         else:
             ec2_service = boto3.client('ec2', region_name=region['RegionName'])
 
-        for launch_request in ec2_service.describe_instances()['Reservations']:
+        regions_state[region['RegionName']] = {
+            'synced': time.strftime(STATE_TIME_FORMAT, time.gmtime()), 'hosts': {}, 'ignored': [], 'launch_times': {}}
+
+        changes = None
+        if state is not None and region['RegionName'] in state['regions']:
+            try:
+                changes = describe_changed_instances(ec2_service, state['regions'][region['RegionName']])
+            except ClientError as e:
+                logging.warning("Incremental refresh of {0} failed, doing a full refresh: {1}".format(
+                    region['RegionName'], e))
+
+        if changes is not None:
+            kept_hosts, kept_ignored, reservations = changes
+            ret += kept_hosts.values()
+            reused_ids.update(host[0] for host in kept_hosts.values())
+            regions_state[region['RegionName']]['hosts'].update(kept_hosts)
+            regions_state[region['RegionName']]['ignored'] += kept_ignored
+            saved_launch_times = state['regions'][region['RegionName']]['launch_times']
+            for instance_id in list(kept_hosts) + kept_ignored:
+                if instance_id in saved_launch_times:
+                    regions_state[region['RegionName']]['launch_times'][instance_id] = saved_launch_times[instance_id]
+        else:
+            reservations = ec2_service.describe_instances()['Reservations']
+
+        for launch_request in reservations:
             for instance in launch_request['Instances']:
                 if instance['State']['Name'] != 'running':
                     continue
 
                 if instance.get('KeyName', None) is None:
+                    regions_state[region['RegionName']]['ignored'].append(instance['InstanceId'])
+                    regions_state[region['RegionName']]['launch_times'][instance['InstanceId']] = str(
+                        instance['LaunchTime'])
                     continue  # Not interested in instances without SSH keys
 
                 instances[instance['InstanceId']] = instance
+                regions_state[region['RegionName']]['launch_times'][instance['InstanceId']] = str(
+                    instance['LaunchTime'])
+                instance_regions[instance['InstanceId']] = region['RegionName']
 
                 if args_user:
                     ami_usernames[instance['ImageId']] = args_user
@@ -249,6 +420,7 @@ def process_aws(args_profile, args_tags_filter, args_region_suffix, args_whiteli
                         'Cannot lookup ip address for instance %s,'
                         ' skipped it.'
                         % instance['InstanceId'])
+                    regions_state[instance_regions[k]]['ignored'].append(instance['InstanceId'])
                     continue
 
         host_id = generate_id(instance, args_tags_filter, args_region_suffix)
@@ -259,25 +431,35 @@ def process_aws(args_profile, args_tags_filter, args_region_suffix, args_whiteli
 
         counts_total[host_id] += 1
 
+        suffix = ''
         if counts_total[host_id] != 1:
             counts_incremental[host_id] += 1
-            host_id += '-' + str(counts_incremental[host_id])
+            suffix = '-' + str(counts_incremental[host_id])
 
-        ssh_config_id = args_host_prefix + host_id + args_host_postfix
+        ssh_config_id = args_host_prefix + host_id + suffix + args_host_postfix
         ssh_config_id = ssh_config_id.replace(' ', '_').lower()  # get rid of spaces
-        
+
+        while ssh_config_id in reused_ids:  # keep numbering clear of hosts carried over from the state file
+            counts_incremental[host_id] += 1
+            ssh_config_id = args_host_prefix + host_id + '-' + str(counts_incremental[host_id]) + args_host_postfix
+            ssh_config_id = ssh_config_id.replace(' ', '_').lower()
+
         launch_key_name = AMI_IDS_TO_KEY.get(instance['ImageId'], instance['KeyName']).replace(' ', '_')
 
-        ret.append(
-            (ssh_config_id,
-             ami_usernames[instance['ImageId']],
-             instance['InstanceId'],
-             instance['ImageId'],
-             launch_key_name,
-             ip_addr,
-             )
-        )
-    return ret
+        host = (ssh_config_id,
+                ami_usernames[instance['ImageId']],
+                instance['InstanceId'],
+                instance['ImageId'],
+                launch_key_name,
+                ip_addr,
+                )
+        ret.append(host)
+        regions_state[instance_regions[k]]['hosts'][instance['InstanceId']] = host
+
+    if args_state_file:
+        save_state(args_state_file, options, ami_usernames, regions_state)
+
+    return sorted(ret)  # same order whether hosts were reused or freshly described
 
 
 def main(args):
@@ -285,7 +467,7 @@ def main(args):
     # neater than docopt [default: ]
     for k in (
             '--default-user', '--user', '--prefix', '--postfix', '--key-dir', '--proxy',
-            '--ssh-key-name', '--profile', '--whitelist-region', ):
+            '--ssh-key-name', '--profile', '--whitelist-region', '--state-file', ):
         if args[k] is None: args[k] = ''
 
     print('# Generated on ' + time.asctime(time.localtime(time.time())))
@@ -295,7 +477,7 @@ def main(args):
 
     config_list = process_aws(args['--profile'], args['--tags'], args['--region-suffix'], args['--whitelist-region'],
                               args['--user'], args['--default-user'], args['--private'], args['--prefix'],
-                              args['--postfix'])
+                              args['--postfix'], args['--state-file'])
 
 
     if args['--superputty']:
@@ -29,6 +29,7 @@ class TestCommandLine(unittest.TestCase):
             '--proxy', 'test_proxy',
             '--region-suffix',
             '--ssh-key-name', 'test_ssh_key_name',
+            '--state-file', 'test_state_file',
             '--strict-hostkey-checking',
             '--tags', 'test_tag1,test_tag21,test_tag3',
             '--user', 'test_user',
@@ -45,6 +46,7 @@ class TestCommandLine(unittest.TestCase):
                      '--proxy': 'test_proxy',
                      '--region-suffix': True,
                      '--ssh-key-name': 'test_ssh_key_name',
+                     '--state-file': 'test_state_file',
                      '--strict-hostkey-checking': True,
                      '--tags': 'test_tag1,test_tag21,test_tag3',
                      '--user': 'test_user',
@@ -66,6 +68,7 @@ class TestCommandLine(unittest.TestCase):
                      '--proxy': None,
                      '--region-suffix': False,
                      '--ssh-key-name': None,
+                     '--state-file': None,
                      '--strict-hostkey-checking': False,
                      '--tags': 'Name,',
                      '--user': None,
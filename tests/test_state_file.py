@@ -0,0 +1,199 @@
+import unittest
+import fnmatch
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+from botocore.exceptions import ClientError
+
+import aws_ssh_config
+
+LAUNCH_TIME = '2019-03-28 14:07:26+00:00'
+
+
+def make_instance(instance_id, name, key_name='demo', ip_addr=None, launch_time=LAUNCH_TIME):
+    instance = {'InstanceId': instance_id,
+                'ImageId': 'ami-1',
+                'LaunchTime': launch_time,
+                'PublicIpAddress': ip_addr or '111.111.111.' + instance_id[2:],
+                'Placement': {'AvailabilityZone': 'eu-west-1a'},
+                'State': {'Code': 16, 'Name': 'running'},
+                'Tags': [{'Key': 'Name', 'Value': name}]}
+    if key_name:
+        instance['KeyName'] = key_name
+    return instance
+
+
+class FakePaginator(object):
+    def __init__(self, ec2_service, operation_name):
+        self.ec2_service = ec2_service
+        self.operation_name = operation_name
+
+    def paginate(self, Filters):
+        if self.operation_name == 'describe_instance_status':
+            if self.ec2_service.denied:
+                raise ClientError({'Error': {'Code': 'UnauthorizedOperation', 'Message': 'denied'}},
+                                  'DescribeInstanceStatus')
+            return [{'InstanceStatuses': [{'InstanceId': i} for i in sorted(self.ec2_service.instances)]}]
+        instances = [self.ec2_service.instances[i] for i in sorted(self.ec2_service.instances)]
+        for f in Filters:
+            if f['Name'] == 'instance-id':
+                instances = [instance for instance in instances if instance['InstanceId'] in f['Values']]
+            elif f['Name'] == 'launch-time':
+                instances = [instance for instance in instances
+                             if any(fnmatch.fnmatch(instance['LaunchTime'].replace(' ', 'T'), v) for v in f['Values'])]
+        self.ec2_service.described += [instance['InstanceId'] for instance in instances]
+        return [{'Reservations': [{'Instances': instances}]}]
+
+
+class FakeEC2(object):
+    def __init__(self, instances):
+        self.instances = dict((instance['InstanceId'], instance) for instance in instances)
+        self.described = []
+        self.denied = False
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self, operation_name)
+
+    def describe_regions(self):
+        return {'Regions': [{'RegionName': 'eu-west-1'}]}
+
+    def describe_instances(self):
+        self.described += sorted(self.instances)
+        return {'Reservations': [{'Instances': [self.instances[i] for i in sorted(self.instances)]}]}
+
+
+class TestStateFile(unittest.TestCase):
+    def setUp(self):
+        self.options = {'tags': 'Name,', 'prefix': '', 'postfix': ''}
+        self.host = ('web', 'ubuntu', 'i-1', 'ami-1', 'demo', '10.0.0.1')
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, 'state.json')
+        self.process_args = {
+            'args_profile': '',
+            'args_tags_filter': 'Name,',
+            'args_region_suffix': False,
+            'args_whitelist_regions': '',
+            'args_user': 'ec2-user',
+            'args_default_user': '',
+            'args_private_ip': False,
+            'args_host_prefix': '',
+            'args_host_postfix': '',
+            'args_state_file': self.state_file,
+        }
+
+    def tearDown(self) -> None:
+        for file_name in os.listdir(self.state_dir):
+            os.remove(os.path.join(self.state_dir, file_name))
+        os.rmdir(self.state_dir)
+
+    def process_aws(self, ec2_service):
+        with mock.patch.object(aws_ssh_config, 'boto3') as boto3:
+            boto3.client.return_value = ec2_service
+            return aws_ssh_config.process_aws(**self.process_args)
+
+    #########################################################################
+
+    # Happy Journey
+    def test_round_trip(self):
+        regions = {'eu-west-1': {'synced': '2019-03-28T14:07:26Z', 'hosts': {'i-1': self.host}, 'ignored': [],
+                                 'launch_times': {'i-1': LAUNCH_TIME}}}
+        aws_ssh_config.save_state(self.state_file, self.options, {'ami-1': 'ubuntu'}, regions)
+
+        actual = aws_ssh_config.load_state(self.state_file, self.options)
+        self.assertEqual({'ami-1': 'ubuntu'}, actual['ami_usernames'])
+        self.assertEqual(list(self.host), actual['regions']['eu-west-1']['hosts']['i-1'])
+        self.assertEqual(['state.json'], os.listdir(self.state_dir))
+
+    def test_options_changed(self):
+        aws_ssh_config.save_state(self.state_file, self.options, {}, {})
+        self.assertIsNone(aws_ssh_config.load_state(self.state_file, dict(self.options, prefix='dev-')))
+
+    def test_missing_or_corrupt(self):
+        self.assertIsNone(aws_ssh_config.load_state(self.state_file, self.options))
+        region_state = '"synced": "2019-03-28T14:07:26Z", "ignored": [], "launch_times": {}'
+        for content in ('', '[]',
+                        '{"options": %s, "ami_usernames": {}, "regions": {"eu-west-1": []}}',
+                        '{"options": %s, "ami_usernames": {}, "regions": {"eu-west-1": {%s, "hosts": {"i-1": ["web"]}}}}',
+                        '{"options": %s, "ami_usernames": {}, "regions": {"eu-west-1": {"hosts": {}}}}'):
+            if '%s' in content:
+                content = content % ((json.dumps(self.options), region_state)[:content.count('%s')])
+            with open(self.state_file, 'w') as state_fp:
+                state_fp.write(content)
+            self.assertIsNone(aws_ssh_config.load_state(self.state_file, self.options))
+
+    def test_save_failure(self):
+        state_file = os.path.join(self.state_dir, 'missing', 'state.json')
+        with self.assertLogs(level='WARNING'):
+            aws_ssh_config.save_state(state_file, self.options, {}, {})
+
+    def test_describe_changed_instances(self):
+        region_state = {'synced': time.strftime(aws_ssh_config.STATE_TIME_FORMAT, time.gmtime()),
+                        'hosts': {'i-1': list(self.host), 'i-2': ['db', 'ubuntu', 'i-2', 'ami-1', 'demo', '10.0.0.2']},
+                        'ignored': ['i-3', 'i-5'],
+                        'launch_times': {'i-1': LAUNCH_TIME, 'i-2': LAUNCH_TIME, 'i-3': LAUNCH_TIME}}
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-3', 'nokey', None),
+                               make_instance('i-4', 'web')])
+
+        kept_hosts, kept_ignored, reservations = aws_ssh_config.describe_changed_instances(ec2_service, region_state)
+        self.assertEqual({'i-1': self.host}, kept_hosts)  # i-2 is gone
+        self.assertEqual(['i-3'], kept_ignored)  # i-5 is gone
+        self.assertEqual(['i-4'], ec2_service.described)
+        self.assertEqual([{'Instances': [ec2_service.instances['i-4']]}], reservations)
+
+    def test_incremental_refresh(self):
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-2', 'web'),
+                               make_instance('i-3', 'nokey', None)])
+        actual = self.process_aws(ec2_service)
+        self.assertEqual(['i-1', 'i-2', 'i-3'], ec2_service.described)  # full refresh, no state yet
+        self.assertEqual(['web', 'web-1'], [host[0] for host in actual])
+
+        # New duplicate is numbered clear of the reused names, i-3 is not fetched again
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-2', 'web'),
+                               make_instance('i-3', 'nokey', None), make_instance('i-4', 'web')])
+        actual = self.process_aws(ec2_service)
+        self.assertEqual(['i-4'], ec2_service.described)
+        self.assertEqual([('web', 'i-1'), ('web-1', 'i-2'), ('web-2', 'i-4')],
+                         [(host[0], host[2]) for host in actual])
+
+        # i-2 terminated, i-3 still ignored, only i-5 is fetched
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-3', 'nokey', None),
+                               make_instance('i-4', 'web'), make_instance('i-5', 'db')])
+        actual = self.process_aws(ec2_service)
+        self.assertEqual(['i-5'], ec2_service.described)
+        self.assertEqual([('db', 'i-5'), ('web', 'i-1'), ('web-2', 'i-4')],
+                         [(host[0], host[2]) for host in actual])
+
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-3', 'nokey', None)])
+        self.process_aws(ec2_service)
+        self.assertEqual([], ec2_service.described)
+
+    def test_restarted_instance(self):
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-2', 'web')])
+        self.process_aws(ec2_service)
+
+        # i-1 was stopped and started again, same id but a new ip and launch time
+        launch_time = time.strftime('%Y-%m-%d %H:%M:%S+00:00', time.gmtime())
+        ec2_service = FakeEC2([make_instance('i-1', 'web', ip_addr='9.9.9.9', launch_time=launch_time),
+                               make_instance('i-2', 'web')])
+        actual = self.process_aws(ec2_service)
+        self.assertEqual(['i-1'], ec2_service.described)
+        self.assertEqual([('web', 'i-1', '9.9.9.9'), ('web-1', 'i-2', '111.111.111.2')],
+                         [(host[0], host[2], host[5]) for host in actual])
+
+        # Described again while its launch day is within the sync window, but the saved host is reused
+        ec2_service = FakeEC2([make_instance('i-1', 'web', ip_addr='9.9.9.9', launch_time=launch_time),
+                               make_instance('i-2', 'web')])
+        self.assertEqual(actual, self.process_aws(ec2_service))
+        self.assertEqual(['i-1'], ec2_service.described)
+
+    def test_status_denied(self):
+        self.process_aws(FakeEC2([make_instance('i-1', 'web')]))
+
+        ec2_service = FakeEC2([make_instance('i-1', 'web'), make_instance('i-2', 'db')])
+        ec2_service.denied = True
+        with self.assertLogs(level='WARNING'):
+            actual = self.process_aws(ec2_service)
+        self.assertEqual(['i-1', 'i-2'], ec2_service.described)  # full refresh
+        self.assertEqual(['db', 'web'], [host[0] for host in actual])